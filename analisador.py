@@ -2,14 +2,17 @@ import os
 import csv
 import json
 import ast
-import time
+import asyncio
+import hashlib
 import logging
+import random
+import shelve
 import argparse
 from typing import Optional, List, Tuple
 
-from pydantic import BaseModel
+from pydantic import BaseModel, ValidationError
 from google import genai
-from google.genai import types
+from google.genai import errors, types
 
 # ================== LOG ==================
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
@@ -41,8 +44,8 @@ def analise_para_json(analise: AnaliseRedacao | dict | None) -> str:
         if isinstance(analise, dict):
             return json.dumps(analise, ensure_ascii=False)
 
-        if hasattr(analise, "model_dump"):
-            return json.dumps(analise.model_dump(exclude_none=True), ensure_ascii=False)
+        if hasattr(analise, "model_dump_json"):
+            return analise.model_dump_json(exclude_none=True)
 
         if hasattr(analise, "json"):
             return analise.json(ensure_ascii=False)
@@ -55,6 +58,26 @@ def analise_para_json(analise: AnaliseRedacao | dict | None) -> str:
         return "{}"
 
 
+def _rejeitar_constante(nome: str):
+    # `json.loads` aceita NaN/Infinity, que `ast.literal_eval` rejeita.
+    raise ValueError(nome)
+
+
+def _parse_lista_rapido(essay_raw: str) -> Optional[list]:
+    """
+    Caminho rápido via `json.loads` para o formato mais comum do dataset.
+    Sem aspas duplas nem barras invertidas, trocar ' por " gera exatamente o
+    mesmo conteúdo que `ast.literal_eval`; nos demais casos retorna None.
+    """
+    if not essay_raw.startswith("["):
+        return None
+    try:
+        if '"' not in essay_raw and "\\" not in essay_raw:
+            return json.loads(essay_raw.replace("'", '"'), parse_constant=_rejeitar_constante)
+        return json.loads(essay_raw, parse_constant=_rejeitar_constante)
+    except ValueError:
+        return None
+
 def parse_essay_field(essay_raw: str) -> str:
     """
     Campo `essay` vem como string de uma lista Python:
@@ -65,63 +88,125 @@ def parse_essay_field(essay_raw: str) -> str:
         return ""
     essay_raw = essay_raw.strip()
     try:
-        parsed = ast.literal_eval(essay_raw)
+        parsed = _parse_lista_rapido(essay_raw)
+        if parsed is None:
+            parsed = ast.literal_eval(essay_raw)
         if isinstance(parsed, list):
             return "\n\n".join(str(p).strip() for p in parsed)
         return str(parsed)
     except Exception:
         return essay_raw
 
-def load_processed_pairs(out_csv: str) -> set[tuple[str, str]]:
+def _col_indices(header: List[str], path: str, *nomes: str) -> Tuple[int, ...]:
+    """Resolve uma vez a posição das colunas usadas, para indexar as linhas do `csv.reader`."""
+    faltando = [c for c in nomes if c not in header]
+    if faltando:
+        raise ValueError(f"Colunas ausentes em '{path}': {', '.join(faltando)}")
+    return tuple(header.index(c) for c in nomes)
+
+def _cell(row: List[str], idx: int) -> str:
+    """Como o `DictReader`: coluna ausente numa linha curta (ex.: última linha truncada) vira ""."""
+    return row[idx] if idx < len(row) else ""
+
+def _pair_key(tema: str, redacao: str) -> bytes:
+    """Digest de 16 bytes do par (tema, redacao): ocupa bem menos memória que as strings."""
+    return hashlib.blake2b(f"{tema}\x1f{redacao}".encode("utf-8"), digest_size=16).digest()
+
+def load_processed_pairs(out_csv: str) -> set[bytes]:
     """
-    Lê o CSV de saída (se existir) e retorna um conjunto de pares (tema, redacao)
-    já processados, para evitar duplicidade e permitir retomar.
+    Lê o CSV de saída (se existir) e retorna o conjunto de chaves (`_pair_key`)
+    dos pares (tema, redacao) já processados, para evitar duplicidade e permitir retomar.
     """
     if not os.path.exists(out_csv):
         return set()
     processed = set()
     with open(out_csv, "r", encoding="utf-8", newline="") as f:
-        reader = csv.DictReader(f)
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is None:
+            return set()
+        tema_idx, red_idx = _col_indices(header, out_csv, "tema", "redacao")
         for row in reader:
-            tema = (row.get("tema") or "").strip()
-            red = (row.get("redacao") or "").strip()
+            tema = _cell(row, tema_idx).strip()
+            red = _cell(row, red_idx).strip()
             if tema or red:
-                processed.add((tema, red))
+                processed.add(_pair_key(tema, red))
     logging.info("Registros já presentes no CSV de saída: %d", len(processed))
     return processed
 
-def ensure_out_header(out_csv: str) -> None:
-    """Garante cabeçalho no CSV de saída (apenas: tema, redacao, resultado_ia)."""
-    write_header = not os.path.exists(out_csv)
-    with open(out_csv, "a", encoding="utf-8", newline="") as f:
-        writer = csv.DictWriter(
-            f,
-            fieldnames=["tema", "redacao", "resultado_ia"],
-        )
-        if write_header:
-            writer.writeheader()
+OUT_FIELDS = ["tema", "redacao", "resultado_ia"]
+FLUSH_A_CADA = 50
+
+def open_out_writer(f) -> csv.DictWriter:
+    """Cria o writer do CSV de saída (apenas: tema, redacao, resultado_ia) e escreve o cabeçalho se o arquivo estiver vazio."""
+    writer = csv.DictWriter(f, fieldnames=OUT_FIELDS)
+    if f.tell() == 0:
+        writer.writeheader()
+    return writer
 
 def append_result(
-    out_csv: str,
+    writer: csv.DictWriter,
     tema: str,
     redacao_texto: str,
     resultado_json: str,
 ) -> None:
-    with open(out_csv, "a", encoding="utf-8", newline="") as f:
-        writer = csv.DictWriter(
-            f,
-            fieldnames=["tema", "redacao", "resultado_ia"],
-        )
-        writer.writerow(
-            {
-                "tema": tema,
-                "redacao": redacao_texto,
-                "resultado_ia": resultado_json,
-            }
-        )
+    writer.writerow(
+        {
+            "tema": tema,
+            "redacao": redacao_texto,
+            "resultado_ia": resultado_json,
+        }
+    )
 
 # ============ CHAMADA À IA ============
-def analisar_redacao_gemini(
+_PROMPT_TEMPLATE = """Você é um corretor de redações especialista no ENEM.
+Analise a redação abaixo e responda ESTRITAMENTE no schema JSON fornecido.
+
+{cabecalho}
+
+Tema: {tema}
+
+Texto:
+---
+{texto}
+---
+"""
+
+# Montado uma vez só: evita refazer a introspecção do schema a cada redação.
+_CONFIG = types.GenerateContentConfig(
+    response_mime_type="application/json",
+    response_schema=AnaliseRedacao,
+    temperature=0.2,
+)
+
+_CLIENT: Optional[genai.Client] = None
+
+def get_client() -> genai.Client:
+    """Retorna um único `genai.Client` por processo, reaproveitando as conexões HTTP."""
+    global _CLIENT
+    if _CLIENT is None:
+        _CLIENT = genai.Client()  # usa GEMINI_API_KEY do ambiente
+    return _CLIENT
+
+def _retry_delay(e: Exception, attempt: int, retry_backoff_s: float, max_retries: int) -> Optional[float]:
+    """
+    Espera antes da próxima tentativa: backoff exponencial com jitter, ou o
+    Retry-After enviado pela API (limitado ao maior backoff possível, para não
+    prender um slot do semáforo por tempo indefinido). Retorna None para erros
+    4xx (exceto 429), que não mudam ao repetir a mesma requisição.
+    """
+    if isinstance(e, errors.ClientError) and e.code not in (408, 429):
+        return None
+    headers = getattr(getattr(e, "response", None), "headers", None) or {}
+    retry_after = headers.get("Retry-After")
+    if retry_after:
+        try:
+            return min(float(retry_after), retry_backoff_s * 2 ** max_retries)
+        except ValueError:
+            pass
+    return retry_backoff_s * (2 ** (attempt - 1)) * random.uniform(0.5, 1.5)
+
+async def analisar_redacao_gemini(
     tema: str,
     texto_redacao: str,
     title: Optional[str] = None,
@@ -129,12 +214,18 @@ def analisar_redacao_gemini(
     score_original: Optional[str] = None,
     model_name: str = "gemini-2.5-flash",
     temperature: float = 0.2,
+    thinking_budget: Optional[int] = None,
     max_retries: int = 3,
     retry_backoff_s: float = 5.0,
+    client: Optional[genai.Client] = None,
+    cache: Optional[shelve.Shelf] = None,
 ) -> Tuple[Optional[AnaliseRedacao], Optional[str]]:
     """
     Envia a redação para avaliação do Gemini e retorna (analise, erro_str).
+    Se `cache` for informado, respostas já obtidas para o mesmo (modelo, temperatura,
+    thinking_budget, prompt) são devolvidas sem nova chamada.
     """
+    client = client or get_client()
     info_extra = []
     if title:
         info_extra.append(f"Título: {title}")
@@ -144,94 +235,125 @@ def analisar_redacao_gemini(
         info_extra.append(f"Nota global (rótulo humano): {score_original}")
 
     cabecalho = "\n".join(info_extra)
-    prompt = f"""Você é um corretor de redações especialista no ENEM.
-Analise a redação abaixo e responda ESTRITAMENTE no schema JSON fornecido.
-
-{cabecalho}
-
-Tema: {tema}
-
-Texto:
----
-{texto_redacao}
----
-"""
-
-    config = types.GenerateContentConfig(
-        response_mime_type="application/json",
-        response_schema=AnaliseRedacao,
-        temperature=temperature,
-    )
+    prompt = _PROMPT_TEMPLATE.format(cabecalho=cabecalho, tema=tema, texto=texto_redacao)
+
+    config = _CONFIG
+    overrides = {}
+    if temperature != _CONFIG.temperature:
+        overrides["temperature"] = temperature
+    if thinking_budget is not None:
+        # 0 desliga o "thinking": bem menos latência por redação, com alguma perda de qualidade.
+        overrides["thinking_config"] = types.ThinkingConfig(thinking_budget=thinking_budget)
+    if overrides:
+        config = _CONFIG.model_copy(update=overrides)
+
+    cache_key = None
+    if cache is not None:
+        cache_key = hashlib.blake2b(
+            f"{model_name}\x1f{temperature}\x1f{thinking_budget}\x1f{prompt}".encode("utf-8")
+        ).hexdigest()
+        if cache_key in cache:
+            try:
+                return AnaliseRedacao.model_validate_json(cache[cache_key]), None
+            except ValidationError:
+                # Entrada corrompida ou de um schema antigo: descarta e consulta a API de novo.
+                logging.warning("Entrada inválida no cache; refazendo a chamada ao Gemini.")
+                del cache[cache_key]
 
     last_err = None
     for attempt in range(1, max_retries + 1):
         try:
-            client = genai.Client()  # usa GEMINI_API_KEY do ambiente
-            resp = client.models.generate_content(
+            resp = await client.aio.models.generate_content(
                 model=model_name,
                 contents=prompt,
                 config=config,
             )
-            analise = resp.parsed
-            if not isinstance(analise, AnaliseRedacao):
-                raise TypeError("A resposta não corresponde ao schema AnaliseRedacao.")
+            if not resp.text:
+                raise ValueError("Resposta vazia do Gemini.")
+            analise = AnaliseRedacao.model_validate_json(resp.text)
+            if cache_key is not None:
+                cache[cache_key] = analise.model_dump_json()
             return analise, None
         except Exception as e:
             last_err = str(e)
             logging.warning("Falha tentativa %d/%d: %s", attempt, max_retries, last_err)
+            espera = _retry_delay(e, attempt, retry_backoff_s, max_retries)
+            if espera is None:
+                break
             if attempt < max_retries:
-                time.sleep(retry_backoff_s * attempt)
+                await asyncio.sleep(espera)
 
     return None, last_err or "Erro desconhecido"
 
 # =============== PIPELINE ===============
-def processar_csv(
+async def _processar_csv_async(
     in_csv: str,
     out_csv: str,
     n: int,
-    tema_padrao: str = "Tema não informado",
-    pular_existentes: bool = True,
-    mostrar_console: bool = False,
-    offset: int = 0,
+    tema_padrao: str,
+    pular_existentes: bool,
+    mostrar_console: bool,
+    offset: int,
+    concorrencia: int,
+    cache: Optional[shelve.Shelf],
+    model_name: str,
+    thinking_budget: Optional[int],
 ) -> None:
-    if "GEMINI_API_KEY" not in os.environ:
-        raise RuntimeError("A variável de ambiente GEMINI_API_KEY não está configurada.")
-
     processed_pairs = load_processed_pairs(out_csv) if pular_existentes else set()
-    ensure_out_header(out_csv)
 
-    enviados = 0
+    pendentes: List[Tuple[str, str, str]] = []
     linha_idx = -1
 
     with open(in_csv, "r", encoding="utf-8", newline="") as f:
-        reader = csv.DictReader(f)
+        reader = csv.reader(f)
+        title_idx, essay_idx = _col_indices(next(reader, []), in_csv, "title", "essay")
         for row in reader:
+            if not row:
+                continue  # linha em branco: o DictReader também a ignorava
             linha_idx += 1
             if linha_idx < offset:
                 continue
-            if enviados >= n:
+            if len(pendentes) >= n:
                 break
 
-            title = (row.get("title") or "").strip()
-            essay_raw = row.get("essay") or ""
+            title = _cell(row, title_idx).strip()
+            essay_raw = _cell(row, essay_idx)
 
             essay_text = parse_essay_field(essay_raw)
             tema = title if title else tema_padrao
 
             # Checagem de retomada com base em (tema, redacao)
-            if pular_existentes and (tema.strip(), essay_text.strip()) in processed_pairs:
+            if pular_existentes and _pair_key(tema.strip(), essay_text.strip()) in processed_pairs:
                 logging.info("Pulando (tema, redacao) já presente no CSV de saída.")
                 continue
 
-            logging.info("Analisando título/tema='%s' ...", tema)
+            pendentes.append((tema, essay_text, title))
 
-            analise, err = analisar_redacao_gemini(
+    client = get_client()
+    sem = asyncio.Semaphore(concorrencia)
+
+    async def analyze_one(tema: str, essay_text: str, title: str):
+        async with sem:
+            logging.info("Analisando título/tema='%s' ...", tema)
+            analise, err = await analisar_redacao_gemini(
                 tema=tema,
                 texto_redacao=essay_text,
                 title=title,
                 competencia_original=None,     # não precisamos mais desses campos no CSV
                 score_original=None,
+                model_name=model_name,
+                thinking_budget=thinking_budget,
+                client=client,
+                cache=cache,
             )
+        return tema, essay_text, analise, err
+
+    # A escrita acontece só neste laço (uma corrotina), então não há disputa pelo CSV.
+    enviados = 0
+    with open(out_csv, "a", encoding="utf-8", newline="") as out_f:
+        writer = open_out_writer(out_f)
+        for fut in asyncio.as_completed([analyze_one(*p) for p in pendentes]):
+            tema, essay_text, analise, err = await fut
 
             if analise:
                 resultado_json = analise_para_json(analise)
@@ -239,7 +361,7 @@ def processar_csv(
                 resultado_json = analise_para_json({"erro": err or "Falha na análise."})
 
             append_result(
-                out_csv=out_csv,
+                writer,
                 tema=tema,
                 redacao_texto=essay_text,
                 resultado_json=resultado_json,
@@ -253,9 +375,55 @@ def processar_csv(
                 print(analise.analise_geral)
 
             enviados += 1
+            if enviados % FLUSH_A_CADA == 0:
+                out_f.flush()
 
     logging.info("Concluído. Enviados %d itens ao Gemini e salvos em '%s'.", enviados, out_csv)
 
+def processar_csv(
+    in_csv: str,
+    out_csv: str,
+    n: int,
+    tema_padrao: str = "Tema não informado",
+    pular_existentes: bool = True,
+    mostrar_console: bool = False,
+    offset: int = 0,
+    concorrencia: int = 16,
+    cache_path: Optional[str] = None,
+    model_name: str = "gemini-2.5-flash",
+    thinking_budget: Optional[int] = None,
+) -> None:
+    """
+    Envia até `n` redações ao Gemini com no máximo `concorrencia` requisições
+    simultâneas; os resultados são gravados na ordem em que ficam prontos.
+    Com `cache_path`, as respostas ficam num cache em disco (shelve) por hash do prompt.
+    """
+    if "GEMINI_API_KEY" not in os.environ:
+        raise RuntimeError("A variável de ambiente GEMINI_API_KEY não está configurada.")
+    if concorrencia < 1:
+        raise ValueError("`concorrencia` deve ser >= 1.")
+
+    cache = shelve.open(cache_path) if cache_path else None
+    try:
+        asyncio.run(
+            _processar_csv_async(
+                in_csv=in_csv,
+                out_csv=out_csv,
+                n=n,
+                tema_padrao=tema_padrao,
+                pular_existentes=pular_existentes,
+                mostrar_console=mostrar_console,
+                offset=offset,
+                concorrencia=concorrencia,
+                cache=cache,
+                model_name=model_name,
+                thinking_budget=thinking_budget,
+            )
+        )
+    finally:
+        if cache is not None:
+            cache.close()
+
 # =============== CLI ====================
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Lê um dataset CSV de redações e envia X primeiras ao Gemini, salvando resultados (tema, redacao, resultado_ia).")
@@ -266,6 +434,10 @@ if __name__ == "__main__":
     parser.add_argument("--tema", dest="tema_padrao", default="Tema não informado", help="Tema padrão caso o título esteja vazio.")
     parser.add_argument("--nao-retomar", dest="retomar", action="store_false", help="Não pular registros já presentes no CSV de saída (baseado em tema+redacao).")
     parser.add_argument("--mostrar", action="store_true", help="Exibe um resumo da análise no console.")
+    parser.add_argument("--concorrencia", type=int, default=16, help="Máximo de requisições simultâneas ao Gemini.")
+    parser.add_argument("--model", dest="model_name", default="gemini-2.5-flash", help="Modelo do Gemini (ex.: gemini-2.5-flash-lite para lotes grandes).")
+    parser.add_argument("--thinking-budget", type=int, default=None, help="Orçamento de tokens de raciocínio; 0 desliga (mais rápido). Padrão: o do modelo.")
+    parser.add_argument("--cache", dest="cache_path", nargs="?", const="gemini_cache.db", default=None, help="Reaproveita respostas já obtidas, guardadas neste arquivo (padrão: gemini_cache.db).")
     args = parser.parse_args()
 
     processar_csv(
@@ -276,4 +448,8 @@ if __name__ == "__main__":
         pular_existentes=args.retomar,
         mostrar_console=args.mostrar,
         offset=args.offset,
+        concorrencia=args.concorrencia,
+        cache_path=args.cache_path,
+        model_name=args.model_name,
+        thinking_budget=args.thinking_budget,
     )
@@ -1,9 +1,17 @@
-import pandas as pd, json, re, unicodedata
+import multiprocessing as mp
+import numpy as np, pandas as pd, json, re, unicodedata
+import pyarrow as pa, pyarrow.csv as pacsv, pyarrow.parquet as pq
+from functools import lru_cache
 from typing import Dict, Any, List
 
+@lru_cache(maxsize=1024)
 def strip_accents(s: str) -> str:
     return ''.join(ch for ch in unicodedata.normalize('NFD', s) if unicodedata.category(ch) != 'Mn')
 
+@lru_cache(maxsize=1024)
+def _normalize(nome: str) -> str:
+    return strip_accents(nome).lower()
+
 def to_int_safe(x) -> int:
     try:
         if isinstance(x, (int,)):
@@ -15,37 +23,44 @@ def to_int_safe(x) -> int:
     except Exception:
         return 0
 
+_RE_COMPETENCIA = re.compile(r"competencia\s*[:(\-]*\s*([1-5])\b")
+_RE_DIGITO = re.compile(r"\b([1-5])\b")
+
+# Regras na ordem de prioridade: a competência casa se cada grupo tiver ao menos uma palavra no nome.
+_KEYWORDS = [
+    ((("norma",), ("padrao", "lingua")), 1),
+    ((("dominio",), ("lingua",)), 1),
+    ((("proposta", "tema", "conhecimento"),), 2),
+    ((("selecion", "relacion", "organ"), ("argument", "ponto de vista", "opin", "fatos")), 3),
+    ((("mecanism", "coes", "coer", "progress"),), 4),
+    ((("intervenc", "direitos humanos", "direitos"),), 5),
+]
+
 def infer_comp_index(nome_norm: str) -> int | None:
-    m = re.search(r"competencia\s*[:(\-]*\s*([1-5])\b", nome_norm)
+    m = _RE_COMPETENCIA.search(nome_norm) or _RE_DIGITO.search(nome_norm)
     if m:
         return int(m.group(1))
-    m2 = re.search(r"\b([1-5])\b", nome_norm)
-    if m2:
-        return int(m2.group(1))
-    n = nome_norm
-    if ("norma" in n and ("padrao" in n or "lingua" in n)) or ("dominio" in n and "lingua" in n):
-        return 1
-    if "proposta" in n or "tema" in n or "conhecimento" in n:
-        return 2
-    if ("selecion" in n or "relacion" in n or "organ" in n) and ("argument" in n or "ponto de vista" in n or "opin" in n or "fatos" in n):
-        return 3
-    if "mecanism" in n or "coes" in n or "coer" in n or "progress" in n:
-        return 4
-    if "intervenc" in n or "direitos humanos" in n or "direitos" in n:
-        return 5
+    for grupos, idx in _KEYWORDS:
+        if all(any(k in nome_norm for k in grupo) for grupo in grupos):
+            return idx
     return None
 
-def extrair_notas(payload: Dict[str, Any]) -> Dict[str, int]:
-    notas = {f"c{i}": 0 for i in range(1, 6)}
+def extrair_pontuacoes(payload: Dict[str, Any]) -> List[int]:
+    """Pontuações de C1..C5 (0 quando a competência não aparece), sem o total."""
+    pontos = [0] * 5
     comps: List[Dict[str, Any]] = payload.get("avaliacoes_competencias", []) or []
     for item in comps:
         nome_raw = str(item.get("competencia", "") or "")
-        nome_norm = strip_accents(nome_raw).lower()
+        nome_norm = _normalize(nome_raw)
         pts = to_int_safe(item.get("pontuacao", 0))
         idx = infer_comp_index(nome_norm)
         if idx and 1 <= idx <= 5:
-            notas[f"c{idx}"] = pts
-    notas["total"] = sum(notas[f"c{i}"] for i in range(1, 6))
+            pontos[idx - 1] = pts
+    return pontos
+
+def extrair_notas(payload: Dict[str, Any]) -> Dict[str, int]:
+    notas = {f"c{i}": p for i, p in enumerate(extrair_pontuacoes(payload), start=1)}
+    notas["total"] = sum(notas.values())
     return notas
 
 def try_parse(value: Any) -> Dict[str, Any]:
@@ -54,30 +69,63 @@ def try_parse(value: Any) -> Dict[str, Any]:
     if pd.isna(value):
         return {}
     s = str(value).strip()
+    # O primeiro caractere já diz o formato: objeto JSON ou JSON serializado dentro de uma string.
+    c = s[:1]
     try:
-        return json.loads(s)
-    except Exception:
-        try:
-            s2 = json.loads(s)
-            if isinstance(s2, str):
-                return json.loads(s2)
-        except Exception:
-            pass
-    return {}
+        if c == "{":
+            parsed = json.loads(s)
+        elif c == '"':
+            parsed = json.loads(json.loads(s))
+        else:
+            return {}
+    except (ValueError, TypeError):
+        return {}
+    return parsed if isinstance(parsed, dict) else {}
+
+# Abaixo disso, subir os processos custa mais do que processar as linhas em série.
+_MIN_LINHAS_POOL = 2000
+_BLOCK_SIZE = 8 << 20
+
+def compute_row(raw: Any) -> List[int]:
+    payload = try_parse(raw)
+    return extrair_pontuacoes(payload) if payload else [0] * 5
 
-def processar_arquivo(input_path: str, output_path: str) -> None:
-    df = pd.read_csv(input_path, encoding="utf-8")
+def processar_arquivo(input_path: str, output_path: str, processos: int | None = None) -> None:
+    """Grava Parquet (zstd) se `output_path` terminar em .parquet; caso contrário, CSV."""
+    with pa.memory_map(input_path) as source:
+        table = pacsv.read_csv(
+            source,
+            read_options=pacsv.ReadOptions(use_threads=True, block_size=_BLOCK_SIZE),
+            # `redacao` sempre tem quebras de linha entre parágrafos; sem isto os blocos são cortados no meio do campo.
+            parse_options=pacsv.ParseOptions(newlines_in_values=True),
+            convert_options=pacsv.ConvertOptions(column_types={"resultado_ia": pa.string()}),
+        )
     pred_cols = [f"predicted_c{i}" for i in range(1, 6)] + ["predicted_total"]
+    values = table.column("resultado_ia").to_pylist()
 
-    def compute_row(raw):
-        payload = try_parse(raw)
-        notas = extrair_notas(payload) if payload else {**{f"c{i}":0 for i in range(1,6)}, "total": 0}
-        return [notas[f"c{i}"] for i in range(1,6)] + [notas["total"]]
+    out = np.zeros((len(values), len(pred_cols)), dtype=np.int32)
+    if len(values) >= _MIN_LINHAS_POOL and processos != 1:
+        with mp.Pool(processos) as pool:
+            for i, row in enumerate(pool.imap(compute_row, values, chunksize=512)):
+                out[i, :5] = row
+    else:
+        for i, raw in enumerate(values):
+            out[i, :5] = compute_row(raw)
+    # O total sai de uma única redução vetorizada em vez de uma soma em Python por linha.
+    out[:, 5] = out[:, :5].sum(axis=1)
 
-    pred_values = df["resultado_ia"].apply(compute_row).tolist()
-    pred_df = pd.DataFrame(pred_values, columns=pred_cols, index=df.index)
-    out_df = pd.concat([df, pred_df], axis=1)
-    out_df.to_csv(output_path, index=False, encoding="utf-8")
+    for j, col in enumerate(pred_cols):
+        arr = pa.array(out[:, j], type=pa.int32())
+        pos = table.schema.get_field_index(col)
+        if pos >= 0:
+            table = table.set_column(pos, col, arr)
+        else:
+            table = table.append_column(col, arr)
+    if output_path.endswith(".parquet"):
+        # Colunas de texto longas (essay, resultado_ia) comprimem muito bem com dicionário + zstd.
+        pq.write_table(table, output_path, compression="zstd", use_dictionary=True)
+    else:
+        pacsv.write_csv(table, output_path, write_options=pacsv.WriteOptions(batch_size=10_000))
 
 if __name__ == "__main__":
     processar_arquivo("essay-br-100-with-ia_.csv", "essay-br-100-with-ia_predicted_v2.csv")
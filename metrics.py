@@ -1,58 +1,164 @@
+import csv
+import os
+from functools import lru_cache
+
 import pandas as pd
 import numpy as np
-from sklearn.metrics import cohen_kappa_score, mean_absolute_error
+import pyarrow as pa
+import pyarrow.csv as pacsv
 
-def formatar_para_br(valor, decimais=2):
+def formatar_coluna_br(serie, decimais=2):
+    """
+    Formata uma coluna de floats como array de strings com vírgula decimal, de uma vez só.
+    Valores NaN viram string vazia.
+    """
+    valores = serie.to_numpy(dtype=np.float64)
+    arredondado = np.round(valores, decimais)
+    # Ruído de ponto flutuante pode deixar -0.0, que sairia impresso como "-0,00".
+    arredondado[arredondado == 0] = 0.0
+    out = np.char.mod(f'%.{decimais}f', arredondado)
+    # Troca '.' por ',' direto nos code points (UCS-4) do array: um único ufunc, sem laço por string.
+    pontos = out.view(np.uint32)
+    pontos[pontos == ord('.')] = ord(',')
+    out[np.isnan(valores)] = ''
+    return out
+
+
+def salvar_csv_br(df, file_name_output, mae_cols, qwk_cols):
     """
-    Formata um valor float para string usando a vírgula como separador decimal.
-    Trata valores NaN retornando uma string vazia.
+    Escreve o CSV separado por ponto e vírgula direto das colunas formatadas em NumPy,
+    sem montar um DataFrame de strings para o `to_csv`.
     """
-    if pd.isna(valor):
-        return ''
+    colunas = []
+    for col in df.columns:
+        if col in mae_cols:
+            colunas.append(formatar_coluna_br(df[col], 2))
+        elif col in qwk_cols:
+            colunas.append(formatar_coluna_br(df[col], 4))
+        else:
+            colunas.append(df[col].astype(str).to_numpy())
+
+    with open(file_name_output, 'w', encoding='utf-8', newline='', buffering=1 << 20) as f:
+        writer = csv.writer(f, delimiter=';', lineterminator='\n')
+        writer.writerow(df.columns)
+        writer.writerows(zip(*colunas))
+
+
+@lru_cache(maxsize=None)
+def _pesos_quadraticos(k):
+    """Matriz K×K de pesos (i - j)², compartilhada (somente leitura) entre as chamadas."""
+    r = np.arange(k, dtype=float)
+    w = (r[:, None] - r[None, :]) ** 2
+    w.setflags(write=False)
+    return w
+
+
+def qwk(y_true, y_pred):
+    """
+    Kappa de Cohen com pesos quadráticos, em forma fechada a partir do histograma K×K.
+    Rótulos = valores presentes em y_true ou y_pred (mesma convenção do sklearn);
+    retorna NaN quando o kappa é indefinido.
+    """
+    levels = np.unique(np.concatenate([y_true, y_pred]))
+    k = len(levels)
+    idx_true = np.searchsorted(levels, y_true)
+    idx_pred = np.searchsorted(levels, y_pred)
+    hist = np.bincount(idx_true * k + idx_pred, minlength=k * k).reshape(k, k).astype(float)
 
-    formatacao_str = f"{round(valor, decimais):.{decimais}f}"
+    w = _pesos_quadraticos(k)
+    observado = (w * hist).sum()
+    esperado = (w * (np.outer(hist.sum(axis=1), hist.sum(axis=0)) / hist.sum())).sum()
+    if esperado == 0:
+        return np.nan
+    return 1 - observado / esperado
 
-    return formatacao_str.replace('.', ',')
 
-def calcular_metricas(df, score_columns):
+def _metricas_competencia(codes, n_groups, y_true, y_pred, valid):
     """
-    Calcula MAE e QWK para todas as colunas de pontuação especificadas para um DataFrame/grupo.
+    MAE e QWK de uma competência para todos os grupos em poucas passadas NumPy,
+    mais a linha geral (todas as redações) na última posição. Só entram as linhas
+    com `valid` verdadeiro (nota real e prevista presentes).
+    Como no `cohen_kappa_score`, os rótulos de cada grupo são apenas os valores
+    presentes nele (em y_true ou y_pred), indexados em ordem crescente.
     """
-    results = {}
-
-    results['num_essays'] = len(df)
+    y_true = y_true[valid]
+    y_pred = y_pred[valid]
+    codes = codes[valid]
+
+    mae = np.full(n_groups + 1, np.nan)
+    qwk_ = np.full(n_groups + 1, np.nan)
+    if len(y_true):
+        mae[n_groups] = np.abs(y_true - y_pred).mean()
+        qwk_[n_groups] = qwk(y_true, y_pred)
+
+    no_grupo = codes >= 0
+    codes = codes[no_grupo]
+    y_true = y_true[no_grupo]
+    y_pred = y_pred[no_grupo]
+    n = len(codes)
+
+    counts = np.bincount(codes, minlength=n_groups)
+    abs_err = np.bincount(codes, weights=np.abs(y_true - y_pred), minlength=n_groups)
+
+    levels, inv = np.unique(np.concatenate([y_true, y_pred]), return_inverse=True)
+    n_levels = len(levels)
+    presentes = np.zeros((n_groups, n_levels), dtype=bool)
+    presentes[codes, inv[:n]] = True
+    presentes[codes, inv[n:]] = True
+    rank = np.cumsum(presentes, axis=1) - 1
+    idx_true = rank[codes, inv[:n]]
+    idx_pred = rank[codes, inv[n:]]
+
+    conf = np.zeros((n_groups, n_levels, n_levels))
+    np.add.at(conf, (codes, idx_true, idx_pred), 1)
+    w = _pesos_quadraticos(n_levels)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mae[:n_groups] = abs_err / counts
+        observado = np.einsum('gij,ij->g', conf, w)
+        esperado = np.einsum('gi,gj,ij->g', conf.sum(axis=2), conf.sum(axis=1), w) / counts
+        qwk_[:n_groups] = np.where(esperado == 0, np.nan, 1 - observado / esperado)
+    return mae, qwk_
+
+
+def calcular_metricas(df, score_columns, group_col):
+    """
+    Calcula num_essays, MAE e QWK por valor de `group_col` e a linha 'Geral',
+    sem montar sub-DataFrames: o agrupamento é feito uma vez com `pd.factorize`.
+    """
+    codes, uniques = pd.factorize(df[group_col], sort=True)
+    n_groups = len(uniques)
+
+    num_essays = np.empty(n_groups + 1, dtype=np.int64)
+    num_essays[:n_groups] = np.bincount(codes[codes >= 0], minlength=n_groups)
+    num_essays[n_groups] = len(df)
+    results = {
+        group_col: np.append(np.asarray(uniques).astype(str), 'Geral'),
+        'num_essays': num_essays,
+    }
 
     for comp_name, (real_col, pred_col) in score_columns.items():
-        valid_data = df.dropna(subset=[real_col, pred_col])
-
-        if valid_data.empty:
-            results[f'MAE_{comp_name}'] = np.nan
-            results[f'QWK_{comp_name}'] = np.nan
-            continue
-
-        y_true = valid_data[real_col].astype(int)
-        y_pred = valid_data[pred_col].astype(int)
-
-        mae = mean_absolute_error(y_true, y_pred)
-        results[f'MAE_{comp_name}'] = mae
+        real = df[real_col]
+        pred = df[pred_col]
+        # Notas do ENEM cabem em int16: metade dos bytes de int32 e 1/4 de float64 nas reduções.
+        results[f'MAE_{comp_name}'], results[f'QWK_{comp_name}'] = _metricas_competencia(
+            codes,
+            n_groups,
+            real.to_numpy(dtype=np.int16, na_value=0),
+            pred.to_numpy(dtype=np.int16, na_value=0),
+            (real.notna() & pred.notna()).to_numpy(),
+        )
 
-        qwk = cohen_kappa_score(y_true, y_pred, weights='quadratic')
-        results[f'QWK_{comp_name}'] = qwk
-
-    return pd.Series(results)
+    # Cada coluna já nasce com o tipo final; o DataFrame só embrulha os arrays.
+    return pd.DataFrame(results, copy=False)
 
 
 def gerar_metricas_por_prompt(file_name_input, file_name_output):
     """
     Carrega o CSV, calcula as métricas por prompt e as métricas gerais,
-    formata os números e salva o resultado final em um CSV separado por ponto e vírgula.
+    formata os números e salva o resultado final em um CSV separado por ponto e vírgula,
+    além de uma versão numérica em Feather ao lado. Retorna as métricas numéricas.
     """
-    try:
-        df = pd.read_csv(file_name_input)
-    except FileNotFoundError:
-        print(f"Erro: Arquivo '{file_name_input}' não encontrado.")
-        return
-
     score_columns = {
         'C1': ('real_c1', 'predicted_c1'),
         'C2': ('real_c2', 'predicted_c2'),
@@ -61,39 +167,46 @@ def gerar_metricas_por_prompt(file_name_input, file_name_output):
         'C5': ('real_c5', 'predicted_c5'),
         'total': ('score', 'predicted_total')
     }
+    score_cols = [col for par in score_columns.values() for col in par]
 
-    results_grouped_df = df.groupby('prompt').apply(
-        lambda x: calcular_metricas(x, score_columns)
-    ).reset_index()
+    if not os.path.exists(file_name_input):
+        print(f"Erro: Arquivo '{file_name_input}' não encontrado.")
+        return
 
-    global_results = calcular_metricas(df, score_columns).to_dict()
-    global_results['prompt'] = 'Geral'
-    global_row_df = pd.DataFrame([global_results])
+    # Só as colunas usadas, já tipadas: sem inferência de tipos nas demais colunas.
+    # `newlines_in_values` porque o campo `essay` pode ter quebras de linha dentro das aspas.
+    with pa.memory_map(file_name_input) as source:
+        table = pacsv.read_csv(
+            source,
+            parse_options=pacsv.ParseOptions(newlines_in_values=True),
+            convert_options=pacsv.ConvertOptions(
+                include_columns=['prompt'] + score_cols,
+                # Como no pandas: prompt em branco vira nulo (fica fora dos grupos, entra só no 'Geral').
+                strings_can_be_null=True,
+                column_types={col: pa.float64() for col in score_cols},
+            ),
+        )
+    # As notas reais vêm como "160.0"; o cast (truncando, como o antigo astype(int)) deixa tudo em int16 anulável.
+    table = table.cast(
+        pa.schema([table.schema.field('prompt')] + [pa.field(col, pa.int16()) for col in score_cols]),
+        safe=False,
+    )
+    df = table.to_pandas(types_mapper=pd.ArrowDtype)
+
+    final_results_df = calcular_metricas(df, score_columns, 'prompt')
 
     mae_cols = [f'MAE_{comp}' for comp in score_columns.keys()]
     qwk_cols = [f'QWK_{comp}' for comp in score_columns.keys()]
-    final_columns = ['prompt', 'num_essays'] + mae_cols + qwk_cols
 
-    results_grouped_df['prompt'] = results_grouped_df['prompt'].astype(str)
-    global_row_df = global_row_df[final_columns]
+    salvar_csv_br(final_results_df, file_name_output, mae_cols, qwk_cols)
+    # Cópia numérica (floats de verdade, sem vírgula decimal) para outros scripts lerem sem reparsear o CSV.
+    file_name_feather = os.path.splitext(file_name_output)[0] + '.feather'
+    final_results_df.to_feather(file_name_feather)
 
-    final_results_df = pd.concat([results_grouped_df, global_row_df], ignore_index=True)
-
-    final_results_df['num_essays'] = final_results_df['num_essays'].round(0).astype(int).astype(str)
-
-    for col in mae_cols:
-        final_results_df[col] = final_results_df[col].apply(lambda x: formatar_para_br(x, 2))
-
-    for col in qwk_cols:
-        final_results_df[col] = final_results_df[col].apply(lambda x: formatar_para_br(x, 4))
-
-    final_results_df.to_csv(file_name_output, index=False, sep=';', encoding='utf-8')
-
-    print(f"Métricas calculadas e salvas em: {file_name_output}")
+    print(f"Métricas calculadas e salvas em: {file_name_output} (e {file_name_feather})")
     return final_results_df
 
-input_file = 'essay-br-100-with-ia_predicted_v2_with_real.csv'
-output_file = 'metricas.csv'
-
 if __name__ == '__main__':
+    input_file = 'essay-br-100-with-ia_predicted_v2_with_real.csv'
+    output_file = 'metricas.csv'
     gerar_metricas_por_prompt(input_file, output_file)
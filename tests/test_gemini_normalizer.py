@@ -0,0 +1,32 @@
+import csv
+import json
+
+import pyarrow.csv as pacsv
+
+import gemini_normalizer
+
+
+def test_processar_arquivo_campo_multilinha_maior_que_um_bloco(tmp_path, monkeypatch):
+    # Bloco pequeno para que o arquivo ocupe vários blocos sem precisar de dezenas de MB.
+    monkeypatch.setattr(gemini_normalizer, "_BLOCK_SIZE", 4096)
+    payload = json.dumps({
+        "avaliacoes_competencias": [
+            {"competencia": f"Competência {i}", "pontuacao": 40 * i} for i in range(1, 6)
+        ]
+    })
+    n = 200
+    entrada = tmp_path / "resultados.csv"
+    with open(entrada, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["tema", "redacao", "resultado_ia"])
+        for i in range(n):
+            writer.writerow([f"Tema {i}", "Parágrafo um.\n\nParágrafo dois.\n\nConclusão.", payload])
+    assert entrada.stat().st_size > 4 * gemini_normalizer._BLOCK_SIZE
+
+    saida = tmp_path / "saida.csv"
+    gemini_normalizer.processar_arquivo(str(entrada), str(saida), processos=1)
+
+    table = pacsv.read_csv(saida, parse_options=pacsv.ParseOptions(newlines_in_values=True))
+    assert table.num_rows == n
+    assert table.column("redacao")[0].as_py() == "Parágrafo um.\n\nParágrafo dois.\n\nConclusão."
+    assert set(table.column("predicted_total").to_pylist()) == {600}
@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import metrics
+
+
+def _escrever_csv(path, prompts, reais, previstas):
+    df = pd.DataFrame({'prompt': prompts, 'essay': ['linha 1\n\nlinha 2'] * len(prompts)})
+    for i in range(1, 6):
+        df[f'real_c{i}'] = reais
+        df[f'predicted_c{i}'] = previstas
+    df['score'] = [5 * r for r in reais]
+    df['predicted_total'] = [5 * p for p in previstas]
+    df.to_csv(path, index=False)
+
+
+def test_prompt_texto_em_branco_fica_fora_dos_grupos(tmp_path):
+    entrada = tmp_path / 'entrada.csv'
+    _escrever_csv(entrada, ['tema A', 'tema B', ''] * 4, [120, 160, 80] * 4, [120, 120, 80] * 4)
+
+    result = metrics.gerar_metricas_por_prompt(str(entrada), str(tmp_path / 'metricas.csv'))
+
+    assert result['prompt'].tolist() == ['tema A', 'tema B', 'Geral']
+    assert result['num_essays'].tolist() == [4, 4, 12]
+    linhas = (tmp_path / 'metricas.csv').read_text(encoding='utf-8').splitlines()
+    assert [linha.split(';')[0] for linha in linhas] == ['prompt', 'tema A', 'tema B', 'Geral']
+
+
+def test_qwk_valores_conhecidos():
+    assert metrics.qwk(np.array([0, 40, 80]), np.array([0, 80, 80])) == pytest.approx(0.8)
+    assert metrics.qwk(np.array([0, 40, 80, 40, 200]), np.array([40, 40, 120, 0, 200])) == pytest.approx(
+        0.8514851485148516
+    )
+    assert np.isnan(metrics.qwk(np.array([120, 120]), np.array([120, 120])))
+
+
+def test_calcular_metricas_grupos_nan_e_geral():
+    df = pd.DataFrame({
+        'prompt': [1, 1, 1, 1, 2, 2, 3],
+        'real_c1': [0, 40, 80, np.nan, 120, 120, 80],
+        'predicted_c1': [0, 80, 80, 40, 120, 120, 40],
+    })
+
+    result = metrics.calcular_metricas(df, {'C1': ('real_c1', 'predicted_c1')}, 'prompt')
+
+    assert result['prompt'].tolist() == ['1', '2', '3', 'Geral']
+    # num_essays conta todas as linhas; MAE/QWK só as que têm as duas notas.
+    assert result['num_essays'].tolist() == [4, 2, 1, 7]
+    assert result['MAE_C1'].tolist() == pytest.approx([40 / 3, 0.0, 40.0, 40 / 3])
+    qwk = result['QWK_C1'].to_numpy()
+    assert qwk[0] == pytest.approx(0.8)
+    assert np.isnan(qwk[1])  # um único rótulo: kappa indefinido
+    assert qwk[2] == pytest.approx(0.0)
+    assert qwk[3] == pytest.approx(0.8536585365853658)
+
+
+def test_formatar_coluna_br_sem_zero_negativo():
+    out = metrics.formatar_coluna_br(pd.Series([-1e-17, -0.0, 0.1236, np.nan]), 3)
+    assert out.tolist() == ['0,000', '0,000', '0,124', '']